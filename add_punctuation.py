@@ -1,7 +1,7 @@
-from modelscope.pipelines import pipeline
 from modelscope.utils.constant import Tasks
+from inference_backend import build_pipeline
 
-inference_pipline = pipeline(
+inference_pipline = build_pipeline(
     task=Tasks.punctuation,
     model='iic/punc_ct-transformer_cn-en-common-vocab471067-large',
     model_revision="v2.0.4")
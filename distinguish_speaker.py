@@ -1,23 +1,65 @@
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from pydub import AudioSegment
-from modelscope.pipelines import pipeline
+from inference_backend import build_pipeline
 from identify_speaker import is_same_speaker, sv_pipeline
 
-# 初始化说话人日志pipeline
-sd_pipeline = pipeline(
-    task='speaker-diarization',
-    model='iic/speech_campplus_speaker-diarization_common',
-    model_revision='v1.0.0'
+def create_sd_pipeline():
+    """
+    创建说话人日志pipeline。
+    """
+    return build_pipeline(
+        task='speaker-diarization',
+        model='iic/speech_campplus_speaker-diarization_common',
+        model_revision='v1.0.0'
+    )
+
+def get_resident_memory_mb() -> float:
+    """
+    获取当前进程的常驻内存 (MB)。
+
+    :return: 常驻内存，无法获取时返回 None
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+# 初始化说话人日志pipeline，并记录加载一个 pipeline 增加的常驻内存，
+# 并行处理时新建的 worker pipeline 按此值估算内存开销
+memory_before_loading = get_resident_memory_mb()
+sd_pipeline = create_sd_pipeline()
+memory_after_loading = get_resident_memory_mb()
+SD_PIPELINE_MEMORY_MB = (
+    memory_after_loading - memory_before_loading
+    if memory_before_loading is not None and memory_after_loading is not None else None
 )
 
-def generate_diarization(test_wav: str) -> dict:
+# 空闲的说话人日志pipeline。并行处理分块时，每个 worker 从中取用一个 pipeline，
+# 用完放回以便复用，保证同一 pipeline 同一时刻只被一个 worker 使用
+idle_sd_pipelines = queue.Queue()
+idle_sd_pipelines.put(sd_pipeline)
+
+def diarization_workers() -> int:
+    """
+    并行生成说话人日志的 worker 数，由环境变量 DIARIZATION_WORKERS 配置，默认为 1。
+    """
+    return max(int(os.getenv("DIARIZATION_WORKERS", "1")), 1)
+
+def generate_diarization(test_wav: str, inference_pipeline=None) -> dict:
     """
     生成音频的说话人日志，并将结果处理成{"speakerX": [[start, end], ...]}格式。
 
     :param test_wav: 需处理的原始音频文件
+    :param inference_pipeline: 使用的说话人日志pipeline，默认为 sd_pipeline
     :return: {"speaker0": [[0.0, 1.0], [2.0, 3.0]...}, "speaker1": ...}
     """
-    raw_diarization = sd_pipeline(test_wav)
+    raw_diarization = (inference_pipeline or sd_pipeline)(test_wav)
     
     processed_diarization = {}
     # raw_diarization['text'] 的格式是 [[start, end, speaker_id], ...]
@@ -32,11 +74,27 @@ def generate_diarization(test_wav: str) -> dict:
         
     return processed_diarization
 
-def clip_audio(input_wav: str, start_time: float, end_time: float, output_wav: str) -> bool:
+def generate_diarization_in_worker(test_wav: str) -> dict:
+    """
+    在 worker 线程中生成说话人日志，从 idle_sd_pipelines 取用空闲的 pipeline，没有空闲时新建一个。
+
+    :param test_wav: 需处理的音频文件
+    :return: {"speaker0": [[0.0, 1.0], ...], ...}
+    """
+    try:
+        inference_pipeline = idle_sd_pipelines.get_nowait()
+    except queue.Empty:
+        inference_pipeline = create_sd_pipeline()
+    try:
+        return generate_diarization(test_wav, inference_pipeline)
+    finally:
+        idle_sd_pipelines.put(inference_pipeline)
+
+def clip_audio(input_wav, start_time: float, end_time: float, output_wav: str) -> bool:
     """
     从音频文件中剪辑一个片段并保存。
 
-    :param input_wav: 输入音频文件
+    :param input_wav: 输入音频文件，或已解码的 AudioSegment（避免重复解码整段音频）
     :param start_time: 开始时间 (秒)
     :param end_time: 结束时间 (秒)
     :param output_wav: 输出音频文件
@@ -47,7 +105,7 @@ def clip_audio(input_wav: str, start_time: float, end_time: float, output_wav: s
     end_ms = int(end_time * 1000)
     
     try:
-        sound = AudioSegment.from_file(input_wav)
+        sound = input_wav if isinstance(input_wav, AudioSegment) else AudioSegment.from_file(input_wav)
         clip = sound[start_ms:end_ms]
         clip.export(output_wav, format="wav")
         return True
@@ -55,122 +113,347 @@ def clip_audio(input_wav: str, start_time: float, end_time: float, output_wav: s
         print(f"Error clipping audio {input_wav}: {e}")
         return False
 
+def get_available_memory_mb() -> float:
+    """
+    获取当前系统的可用内存 (MB)。
+
+    :return: 可用内存，无法获取时返回 None
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def estimate_chunk_memory_mb(chunk_size: float) -> float:
+    """
+    估算一个 worker 处理 chunk_size 分钟音频块时，除模型本身外的峰值内存 (MB)：
+        - 音频：16 kHz 单声道 float32 为 3.84 MB/min，读取、重采样、特征提取过程中按 4 份副本计
+        - 声纹：CAM++ 以 1.5 s 窗长、0.75 s 步长提取，每分钟 80 个 192 维向量，可忽略
+        - 聚类：谱聚类构建 N×N 的 float64 相似度矩阵 (N = 80 × 分钟数)，连同拉普拉斯矩阵和特征分解按 4 份计
+    20 分钟的分块约为 300 MB（音频）+ 80 MB（聚类）。聚类部分随分块时长平方增长。
+
+    :param chunk_size: 分块大小 (分钟)
+    :return: 估算的内存占用 (MB)
+    """
+    audio_mb = 16000 * 4 * 60 / (1024 * 1024) * chunk_size * 4
+    embeddings = 80 * chunk_size
+    clustering_mb = embeddings ** 2 * 8 * 4 / (1024 * 1024)
+    return audio_mb + clustering_mb
+
+def adaptive_chunk_size(
+    duration: float,
+    workers: int = 1,
+    sound_memory: float = 0.0,
+    available_memory: float = None,
+    min_chunk_size: float = 2,
+    max_chunk_size: float = 20
+) -> float:
+    """
+    根据可用内存和并行处理的 worker 数确定分块大小：
+        1. 整段解码音频、额外 worker 新建的 pipeline（第一个 worker 复用已加载的 sd_pipeline，
+           每个按加载时实测的 SD_PIPELINE_MEMORY_MB 计）以及所有 worker 同时处理分块的内存
+           （estimate_chunk_memory_mb）之和不超过可用内存的 80%
+        2. 分块数不少于 worker 数，使每个 worker 都有分块可处理
+    最小分块仍无法满足内存预算时打印警告，并使用最小分块继续处理。
+
+    :param duration: 音频总时长 (秒)
+    :param workers: 并行处理分块的 worker 数
+    :param sound_memory: 主线程中常驻的整段解码音频的内存 (MB)
+    :param available_memory: 解码音频之前的可用内存 (MB)，默认为当前可用内存
+    :param min_chunk_size: 最小分块大小 (分钟)
+    :param max_chunk_size: 最大分块大小 (分钟)
+    :return: 分块大小 (分钟)
+    """
+    # 无法实测时（非 Linux）使用 DIARIZATION_MODEL_MEMORY_MB
+    pipeline_memory = SD_PIPELINE_MEMORY_MB
+    if pipeline_memory is None:
+        pipeline_memory = float(os.getenv("DIARIZATION_MODEL_MEMORY_MB", "500"))
+
+    chunk_size = max_chunk_size
+    if available_memory is None:
+        available_memory = get_available_memory_mb()
+    if available_memory:
+        budget = (available_memory * 0.8 - sound_memory - (workers - 1) * pipeline_memory) / workers
+        while chunk_size > min_chunk_size and estimate_chunk_memory_mb(chunk_size) > budget:
+            chunk_size = max(chunk_size - 0.5, min_chunk_size)
+        if estimate_chunk_memory_mb(chunk_size) > budget:
+            print(
+                f"Warning: {available_memory:.0f} MB available is not enough for {workers} worker(s): "
+                f"audio {sound_memory:.0f} MB, pipeline {pipeline_memory:.0f} MB per extra worker, "
+                f"{estimate_chunk_memory_mb(chunk_size):.0f} MB per {chunk_size:.1f} min chunk. "
+                f"Consider lowering DIARIZATION_WORKERS."
+            )
+    if workers > 1:
+        chunk_size = min(chunk_size, duration / 60 / workers)
+
+    return max(min_chunk_size, min(chunk_size, max_chunk_size))
+
+def find_quietest_point(sound: AudioSegment, start_ms: int, end_ms: int, target_ms: int, frame_ms: int = 100) -> int:
+    """
+    在 [start_ms, end_ms) 范围内寻找能量最低的位置，能量相同时取离 target_ms 最近的位置。
+
+    :param sound: 音频
+    :param start_ms: 搜索起点 (毫秒)
+    :param end_ms: 搜索终点 (毫秒)
+    :param target_ms: 期望的切分位置 (毫秒)
+    :param frame_ms: 计算能量的帧长 (毫秒)
+    :return: 切分位置 (毫秒)
+    """
+    best_ms, best_key = target_ms, None
+    for t in range(max(start_ms, 0), min(end_ms, len(sound)) - frame_ms + 1, frame_ms):
+        key = (sound[t:t + frame_ms].rms, abs(t + frame_ms // 2 - target_ms))
+        if best_key is None or key < best_key:
+            best_ms, best_key = t + frame_ms // 2, key
+    return best_ms
+
+def find_cut_points(sound: AudioSegment, chunk_size_ms: int, search_ms: int) -> list:
+    """
+    在每个分块的目标边界附近寻找静音位置作为切分点。
+    剩余音频不足 1.5 个分块时不再切分，避免产生过短的末尾分块。
+
+    :param sound: 音频
+    :param chunk_size_ms: 目标分块大小 (毫秒)
+    :param search_ms: 在目标边界前后搜索静音的范围 (毫秒)
+    :return: 切分点列表 (毫秒)
+    """
+    search_ms = min(search_ms, chunk_size_ms // 4)
+    cut_points = []
+    position = 0
+    while len(sound) - position > chunk_size_ms * 1.5:
+        target = position + chunk_size_ms
+        position = find_quietest_point(sound, target - search_ms, target + search_ms, target)
+        cut_points.append(position)
+    return cut_points
+
+def overlap_duration(segments: list, start: float, end: float) -> float:
+    """
+    计算一组片段落在 [start, end] 范围内的总时长。
+
+    :param segments: [[start, end], ...]
+    :param start: 范围起点 (秒)
+    :param end: 范围终点 (秒)
+    :return: 重叠时长 (秒)
+    """
+    return sum(max(0.0, min(e, end) - max(s, start)) for s, e in segments)
+
+def longest_segment(segments: list) -> list:
+    """
+    返回时长最长的片段，用于提取更可靠的说话人声纹。
+
+    :param segments: [[start, end], ...]
+    :return: [start, end]
+    """
+    return max(segments, key=lambda segment: segment[1] - segment[0])
+
+def remove_anchor_clips(anchor_clips: dict, temp_dir: str = "temp_clips") -> None:
+    """
+    删除缓存的基准说话人片段及其临时目录。
+
+    :param anchor_clips: {speaker_id: [start, end, clip_path]}
+    :param temp_dir: 临时目录
+    """
+    for _, _, clip_path in anchor_clips.values():
+        if os.path.exists(clip_path):
+            os.remove(clip_path)
+    anchor_clips.clear()
+    if os.path.isdir(temp_dir) and not os.listdir(temp_dir):
+        os.rmdir(temp_dir)
+
 def merge_same_speaker(
     anchor_wav: str, 
     final_diarization: dict, 
     test_wav: str, 
     test_diarization: dict, 
-    interval: float
+    interval: float,
+    overlap: float = 0.0,
+    min_overlap_ratio: float = 0.5,
+    anchor_clips: dict = None
 ) -> dict:
     """
-    合并已确认的和待确认的说话人日志，以 dict 形式返回
+    合并已确认的和待确认的说话人日志，以 dict 形式返回。
+    当前音频块开头的 overlap 秒与上一块的末尾重叠：
+        1. 在重叠区域内与某个已确认说话人时间上吻合的说话人，直接沿用该说话人
+        2. 其余说话人使用各自最长的片段，与已确认说话人的最长片段进行声纹比对
+        3. 重叠区域内的片段已由上一块给出，合并时只保留重叠区域之后的部分
 
-    :param anchor_wav: 原始完整音频文件，用于提取基准说话人片段
+    :param anchor_wav: 原始完整音频文件或已解码的 AudioSegment，用于提取基准说话人片段
     :param final_diarization: 已合并的最终说话人日志
     :param test_wav: 当前待处理的音频块文件
     :param test_diarization: 当前待处理音频块的日志
     :param interval: 当前音频块在原始音频中的开始时间 (秒)
+    :param overlap: 当前音频块与上一块重叠的时长 (秒)
+    :param min_overlap_ratio: 重叠区域内时间吻合的比例阈值，达到该比例即认为是同一说话人
+    :param anchor_clips: 基准说话人片段的缓存 {speaker_id: [start, end, clip_path]}，跨多次合并复用，
+                         由调用方负责清理；默认为空，此时在本次合并结束时清理
     :return: 合并后的说话人日志
     """
-    merged_diarization = final_diarization.copy()
+    merged_diarization = {speaker_id: list(segments) for speaker_id, segments in final_diarization.items()}
     speaker_mapping = {}
+
+    # 1. 在重叠区域内按时间吻合程度对齐说话人
+    if overlap > 0:
+        for test_speaker_id, test_segments in test_diarization.items():
+            shifted_segments = [
+                [start + interval, min(end, overlap) + interval]
+                for start, end in test_segments if start < overlap
+            ]
+            test_duration = overlap_duration(shifted_segments, interval, interval + overlap)
+            if test_duration <= 0:
+                continue
+
+            best_speaker_id, best_duration = None, 0.0
+            for speaker_id, segments in final_diarization.items():
+                matched_duration = sum(
+                    overlap_duration(segments, start, end) for start, end in shifted_segments
+                )
+                if matched_duration > best_duration:
+                    best_speaker_id, best_duration = speaker_id, matched_duration
+
+            if best_speaker_id and best_duration / test_duration >= min_overlap_ratio:
+                speaker_mapping[test_speaker_id] = best_speaker_id
+
+    # 2. 对未能对齐的说话人进行声纹比对；片段全部落在重叠区域内的说话人已由上一块给出，直接跳过
+    unmatched_speakers = [
+        speaker_id for speaker_id, segments in test_diarization.items()
+        if speaker_id not in speaker_mapping and any(end > overlap for _, end in segments)
+    ]
+    new_speaker_idx = len(final_diarization)
+    owns_anchor_clips = anchor_clips is None
+    anchor_clips = {} if owns_anchor_clips else anchor_clips
     temp_dir = "temp_clips"
-    os.makedirs(temp_dir, exist_ok=True)
+    if unmatched_speakers:
+        os.makedirs(temp_dir, exist_ok=True)
 
-    # 提取基准说话人的音频片段
-    anchor_clips = {}
-    for speaker_id, segments in final_diarization.items():
-        if segments:
-            start, end = segments[0]
+        # 提取基准说话人的音频片段，最长片段未变化的说话人直接复用缓存
+        for speaker_id, segments in final_diarization.items():
+            if not segments:
+                continue
+            start, end = longest_segment(segments)
+            cached = anchor_clips.get(speaker_id)
+            if cached and cached[:2] == [start, end] and os.path.exists(cached[2]):
+                continue
             clip_path = os.path.join(temp_dir, f"anchor_{speaker_id}.wav")
-            clip_audio(anchor_wav, start, end, clip_path)
-            anchor_clips[speaker_id] = clip_path
+            if clip_audio(anchor_wav, start, end, clip_path):
+                anchor_clips[speaker_id] = [start, end, clip_path]
 
-    # 将新片段的说话人与基准说话人进行比对
-    new_speaker_idx = len(final_diarization)
-    for test_speaker_id, test_segments in test_diarization.items():
-        if not test_segments: continue
-        
-        test_start, test_end = test_segments[0]
-        test_clip_path = os.path.join(temp_dir, f"test_{test_speaker_id}.wav")
-        clip_audio(test_wav, test_start, test_end, test_clip_path)
-
-        found_match = False
-        for anchor_speaker_id, anchor_clip_path in anchor_clips.items():
-            if is_same_speaker(anchor_clip_path, test_clip_path):
-                speaker_mapping[test_speaker_id] = anchor_speaker_id
-                found_match = True
-                break
-        
-        if not found_match:
-            # 如果没有找到匹配项，则创建新说话人
-            new_speaker_id = f"speaker{new_speaker_idx}"
-            speaker_mapping[test_speaker_id] = new_speaker_id
-            new_speaker_idx += 1
-        
-        os.remove(test_clip_path)
+        # 将新片段的说话人与基准说话人进行比对
+        for test_speaker_id in unmatched_speakers:
+            test_start, test_end = longest_segment(test_diarization[test_speaker_id])
+            test_clip_path = os.path.join(temp_dir, f"test_{test_speaker_id}.wav")
+            clip_audio(test_wav, test_start, test_end, test_clip_path)
+
+            found_match = False
+            for anchor_speaker_id, (_, _, anchor_clip_path) in anchor_clips.items():
+                if is_same_speaker(anchor_clip_path, test_clip_path):
+                    speaker_mapping[test_speaker_id] = anchor_speaker_id
+                    found_match = True
+                    break
+            
+            if not found_match:
+                # 如果没有找到匹配项，则创建新说话人
+                new_speaker_id = f"speaker{new_speaker_idx}"
+                speaker_mapping[test_speaker_id] = new_speaker_id
+                new_speaker_idx += 1
+            
+            if os.path.exists(test_clip_path):
+                os.remove(test_clip_path)
 
-    # 根据映射关系，合并日志
+    # 清理临时文件
+    if owns_anchor_clips:
+        remove_anchor_clips(anchor_clips, temp_dir)
+
+    # 3. 根据映射关系，合并重叠区域之后的日志
     for test_speaker_id, segments in test_diarization.items():
         final_speaker_id = speaker_mapping.get(test_speaker_id)
         if not final_speaker_id: continue
 
-        if final_speaker_id not in merged_diarization:
-            merged_diarization[final_speaker_id] = []
-        
-        for start, end in segments:
-            merged_diarization[final_speaker_id].append([start + interval, end + interval])
-
-    # 清理临时文件
-    for clip_path in anchor_clips.values():
-        os.remove(clip_path)
-    os.rmdir(temp_dir)
+        kept_segments = [
+            [round(max(start, overlap) + interval, 2), round(end + interval, 2)]
+            for start, end in segments if end > overlap
+        ]
+        if kept_segments:
+            merged_diarization.setdefault(final_speaker_id, []).extend(kept_segments)
             
     return merged_diarization
 
 
-def distinguish_speaker(raw_wav: str, chunk_size: float = 20) -> dict:
+def distinguish_speaker(
+    raw_wav: str,
+    chunk_size: float = None,
+    overlap: float = 5,
+    silence_search: float = 30
+) -> dict:
     """
     将长音频分块处理，并合并结果，生成最终的说话人日志。
+    分块边界选在目标大小附近的静音处，相邻分块之间保留 overlap 秒的重叠，用于拼接时对齐说话人。
 
     :param raw_wav: 需处理的原始音频文件
-    :param chunk_size: 分隔原始音频的大小 (分钟), 默认为 20 min。
+    :param chunk_size: 分隔原始音频的目标大小 (分钟)，默认根据可用内存和 worker 数自动确定
+    :param overlap: 相邻分块之间的重叠时长 (秒)，默认为 5 s
+    :param silence_search: 在目标边界前后搜索静音的范围 (秒)，默认为 30 s
     :return: {"speaker0": [[0.0, 1.0], ...], "speaker1": [[...], ...]}
     """
-    chunk_size_ms = int(chunk_size * 60 * 1000)
+    workers = diarization_workers()
+    available_memory = get_available_memory_mb()
+    # 整段音频只解码一次，分块和提取基准说话人片段都从内存中的音频截取
     sound = AudioSegment.from_file(raw_wav)
+    if chunk_size is None:
+        sound_memory = len(sound.raw_data) / (1024 * 1024)
+        chunk_size = adaptive_chunk_size(len(sound) / 1000.0, workers, sound_memory, available_memory)
+    chunk_size_ms = int(chunk_size * 60 * 1000)
+    overlap_ms = int(overlap * 1000)
+    print(f"Using chunk size {chunk_size:.2f} min with {overlap:.1f}s overlap and {workers} worker(s).")
+
     temp_chunk_dir = "temp_chunks"
     os.makedirs(temp_chunk_dir, exist_ok=True)
     
-    # 1. 分割音频
+    # 1. 在静音处分割音频，后续分块向前多取 overlap 的重叠部分
+    boundaries = [0] + find_cut_points(sound, chunk_size_ms, int(silence_search * 1000)) + [len(sound)]
     chunk_files = []
-    for i, chunk in enumerate(sound[::chunk_size_ms]):
+    for i in range(len(boundaries) - 1):
+        if boundaries[i + 1] <= boundaries[i]:
+            continue
+        chunk_start = max(boundaries[i] - overlap_ms, 0) if i > 0 else 0
         chunk_path = os.path.join(temp_chunk_dir, f"chunk_{i}.wav")
-        chunk.export(chunk_path, format="wav")
-        chunk_files.append(chunk_path)
+        sound[chunk_start:boundaries[i + 1]].export(chunk_path, format="wav")
+        chunk_files.append((chunk_path, chunk_start, boundaries[i] - chunk_start))
 
     if not chunk_files:
+        os.rmdir(temp_chunk_dir)
         return {}
         
-    # 2. 处理第一个音频块作为基准
-    print(f"Processing chunk 0...")
-    final_diarization = generate_diarization(chunk_files[0])
-    
-    # 3. 循环处理后续音频块并合并
-    for i in range(1, len(chunk_files)):
-        print(f"Processing and merging chunk {i}...")
-        test_chunk_wav = chunk_files[i]
-        test_diarization = generate_diarization(test_chunk_wav)
-        interval_s = (i * chunk_size_ms) / 1000.0
+    # 2. 由 workers 个 worker 并行生成各音频块的说话人日志，第一个音频块作为基准
+    anchor_clips = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_diarization_in_worker, chunk_path) for chunk_path, _, _ in chunk_files]
+
+        print(f"Processing chunk 0...")
+        final_diarization = futures[0].result()
         
-        final_diarization = merge_same_speaker(
-            raw_wav, final_diarization, test_chunk_wav, test_diarization, interval_s
-        )
+        # 3. 按顺序合并后续音频块，合并时其余 worker 继续处理后面的音频块
+        for i in range(1, len(chunk_files)):
+            print(f"Processing and merging chunk {i}...")
+            test_chunk_wav, chunk_start_ms, chunk_overlap_ms = chunk_files[i]
+            test_diarization = futures[i].result()
+            
+            final_diarization = merge_same_speaker(
+                sound, final_diarization, test_chunk_wav, test_diarization,
+                chunk_start_ms / 1000.0, chunk_overlap_ms / 1000.0,
+                anchor_clips=anchor_clips
+            )
     
-    # 4. 清理分块的临时文件
-    for chunk_file in chunk_files:
+    # 4. 清理分块和基准说话人片段的临时文件
+    for chunk_file, _, _ in chunk_files:
         os.remove(chunk_file)
     os.rmdir(temp_chunk_dir)
+    remove_anchor_clips(anchor_clips)
 
     # 5. 对最终结果按时间排序
     for speaker in final_diarization:
@@ -182,7 +465,7 @@ if __name__ == "__main__":
 
     input_wav = 'part1.mp3'
     if os.path.exists(input_wav):
-        final_result = distinguish_speaker(input_wav, chunk_size=20) # 使用5分钟的块大小进行测试
+        final_result = distinguish_speaker(input_wav) # 分块大小根据可用内存自动确定
         import json
         print(json.dumps(final_result, indent=2))
     else:
@@ -1,7 +1,7 @@
-from modelscope.pipelines import pipeline
+from inference_backend import build_pipeline
 
 # 初始化说话人验证pipeline
-sv_pipeline = pipeline(
+sv_pipeline = build_pipeline(
     task='speaker-verification',
     model='iic/speech_campplus_sv_zh-cn_16k-common',
     model_revision='v1.0.0'
@@ -0,0 +1,394 @@
+import os
+import re
+import sys
+import json
+import copy
+import difflib
+import time
+import torch
+import torch.ao.nn.quantized.dynamic as nnqd
+from torch.ao.quantization import quantize_dynamic
+from dotenv import load_dotenv
+from modelscope.pipelines import pipeline
+
+# 加载.env文件（不覆盖已有环境变量）
+load_dotenv()
+
+# 推理后端：eager（默认 PyTorch 推理）/ int8（动态 int8 量化，适用于无 GPU 的推理节点）
+INFERENCE_BACKENDS = ("eager", "int8")
+
+def configure_threads() -> None:
+    """
+    根据环境变量设置当前进程的 PyTorch 线程数，未配置时保持 PyTorch 默认值。
+        INFERENCE_INTRA_OP_THREADS: 单个算子内部的并行线程数
+        INFERENCE_INTER_OP_THREADS: 算子之间的并行线程数（须在首次推理前设置）
+    """
+    intra_op_threads = os.getenv("INFERENCE_INTRA_OP_THREADS")
+    inter_op_threads = os.getenv("INFERENCE_INTER_OP_THREADS")
+
+    if intra_op_threads:
+        torch.set_num_threads(int(intra_op_threads))
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(int(inter_op_threads))
+        except RuntimeError as e:
+            # 已经开始过并行计算后无法再修改
+            print(f"Failed to set inter-op threads: {e}")
+
+configure_threads()
+
+# 动态 int8 量化支持的层类型
+DYNAMIC_QUANT_TYPES = {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}
+QUANTIZED_TYPES = (nnqd.Linear, nnqd.LSTM, nnqd.GRU)
+
+# pipeline 中可能持有 PyTorch 模型的属性：
+#     model: modelscope 模型，FunASR 模型会再包一层 AutoModel，真正的 torch 模型在更深的 .model 中
+#     sv_pipeline: 说话人日志 pipeline 内部用于提取 CAM++ 声纹的说话人确认 pipeline
+MODEL_ATTRS = ("model", "sv_pipeline")
+
+class PointwiseConv1d(torch.nn.Module):
+    """
+    与 kernel_size=1 的 Conv1d 等价的 Linear 实现，使其可以做动态 int8 量化。
+    CAM++ 中大部分 Conv1d（TDNN 层的 bottleneck、transit 层、最后的 dense 层）都是这种逐点卷积。
+    """
+
+    def __init__(self, conv: torch.nn.Conv1d):
+        super().__init__()
+        self.linear = torch.nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        with torch.no_grad():
+            self.linear.weight.copy_(conv.weight[:, :, 0])
+            if conv.bias is not None:
+                self.linear.bias.copy_(conv.bias)
+
+    def forward(self, x):
+        # (..., C, T) -> (..., T, C) -> Linear -> (..., C_out, T)
+        return self.linear(x.transpose(-1, -2)).transpose(-1, -2)
+
+def replace_pointwise_conv1d(module: torch.nn.Module) -> int:
+    """
+    将模型中的逐点 Conv1d 原地替换为等价的 PointwiseConv1d。
+
+    :param module: PyTorch 模型
+    :return: 替换的层数
+    """
+    count = 0
+    for name, child in module.named_children():
+        if (
+            type(child) is torch.nn.Conv1d
+            and child.kernel_size == (1,)
+            and child.stride == (1,)
+            and child.padding == (0,)
+            and child.dilation == (1,)
+            and child.groups == 1
+        ):
+            setattr(module, name, PointwiseConv1d(child))
+            count += 1
+        else:
+            count += replace_pointwise_conv1d(child)
+    return count
+
+def find_torch_models(obj, depth: int = 4, seen: set = None) -> list:
+    """
+    沿 MODEL_ATTRS 查找 pipeline 中实际执行推理的 PyTorch 模型。
+
+    :param obj: pipeline 或模型包装对象
+    :param depth: 最大查找深度
+    :return: 互不包含的 torch.nn.Module 列表
+    """
+    seen = set() if seen is None else seen
+    if obj is None or id(obj) in seen or depth < 0:
+        return []
+    seen.add(id(obj))
+
+    models = [obj] if isinstance(obj, torch.nn.Module) else []
+    for attr in MODEL_ATTRS:
+        models += find_torch_models(getattr(obj, attr, None), depth - 1, seen)
+
+    # 去掉已经是其他模型子模块的模型，避免重复量化
+    return [
+        model for model in models
+        if not any(other is not model and any(m is model for m in other.modules()) for other in models)
+    ]
+
+def count_quantized_modules(inference_pipeline) -> int:
+    """
+    统计 pipeline 中已量化的模块数。
+
+    :param inference_pipeline: modelscope pipeline
+    :return: 已量化的模块数
+    """
+    return sum(
+        isinstance(module, QUANTIZED_TYPES)
+        for model in find_torch_models(inference_pipeline)
+        for module in model.modules()
+    )
+
+def quantize_pipeline(inference_pipeline):
+    """
+    对 pipeline 中的 PyTorch 模型做动态 int8 量化，原地修改：
+        1. 逐点 Conv1d 替换为等价的 Linear
+        2. Linear / LSTM / GRU 做动态 int8 量化（其余卷积层保持 fp32）
+
+    :param inference_pipeline: modelscope pipeline
+    :return: 量化后的 pipeline
+    """
+    name = type(inference_pipeline).__name__
+    models = find_torch_models(inference_pipeline)
+
+    converted = 0
+    for model in models:
+        model.eval()
+        converted += replace_pointwise_conv1d(model)
+        quantize_dynamic(model, DYNAMIC_QUANT_TYPES, dtype=torch.qint8, inplace=True)
+
+    quantized = count_quantized_modules(inference_pipeline)
+    print(f"{name}: quantized {quantized} modules in {len(models)} torch models ({converted} pointwise Conv1d converted).")
+    if quantized == 0:
+        raise RuntimeError(f"{name} 中没有找到可量化的模块，无法使用 int8 推理后端")
+    return inference_pipeline
+
+def build_pipeline(task: str, model: str, model_revision: str, backend: str = None):
+    """
+    创建 modelscope pipeline，并按所选推理后端进行优化。
+
+    :param task: pipeline 任务名
+    :param model: 模型 ID
+    :param model_revision: 模型版本
+    :param backend: 推理后端，默认读取环境变量 INFERENCE_BACKEND，未配置时为 eager
+    :return: pipeline
+    """
+    backend = (backend or os.getenv("INFERENCE_BACKEND", "eager")).lower()
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"不支持的推理后端 {backend}，可选：{', '.join(INFERENCE_BACKENDS)}")
+
+    inference_pipeline = pipeline(task=task, model=model, model_revision=model_revision)
+    if backend == "int8":
+        inference_pipeline = quantize_pipeline(inference_pipeline)
+    return inference_pipeline
+
+# 精度检查的容差：标点、分段为文本相似度下限，说话人日志为时间一致程度下限，
+# 说话人确认为 eager 与 int8 分数之差的上限（同时要求在 VERIFICATION_THRESHOLD 下的判定一致）
+ACCURACY_TOLERANCES = {
+    "punctuation": 0.98,
+    "segmentation": 0.98,
+    "verification": 0.05,
+    "diarization": 0.95,
+}
+# 与 identify_speaker.is_same_speaker 的默认阈值一致
+VERIFICATION_THRESHOLD = 0.5
+
+# 精度检查默认使用的音频，来自 CAM++ 模型卡片中的示例
+MODELSCOPE_EXAMPLE_URL = "https://modelscope.cn/api/v1/models/damo/{model}/repo?Revision=master&FilePath=examples/{file}"
+DEFAULT_WAV_PAIRS = [
+    # 同一说话人
+    (
+        MODELSCOPE_EXAMPLE_URL.format(model="speech_campplus_sv_zh-cn_16k-common", file="speaker1_a_cn_16k.wav"),
+        MODELSCOPE_EXAMPLE_URL.format(model="speech_campplus_sv_zh-cn_16k-common", file="speaker1_b_cn_16k.wav"),
+    ),
+    # 不同说话人
+    (
+        MODELSCOPE_EXAMPLE_URL.format(model="speech_campplus_sv_zh-cn_16k-common", file="speaker1_a_cn_16k.wav"),
+        MODELSCOPE_EXAMPLE_URL.format(model="speech_campplus_sv_zh-cn_16k-common", file="speaker2_a_cn_16k.wav"),
+    ),
+]
+DEFAULT_DIARIZATION_WAVS = [
+    MODELSCOPE_EXAMPLE_URL.format(model="speech_campplus_speaker-diarization_common", file="2speakers_example.wav"),
+]
+
+def load_default_texts(path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcription_result.json")) -> list:
+    """
+    从仓库中的示例转写结果读取文本，去掉标点和空白后作为标点、分段精度检查的默认输入。
+
+    :param path: 转写结果文件 {"result": [[start, end, speaker, text], ...]}
+    :return: 无标点文本列表
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        segments = json.load(f).get("result", [])
+    texts = [re.sub(r"[，。、！？；：“”‘’（）,.!?;:()\s]", "", text) for _, _, _, text in segments]
+    return [text for text in texts if text]
+
+def text_similarity(a: str, b: str) -> float:
+    """
+    计算两段文本的相似度。
+
+    :return: 0~1，1 表示完全一致
+    """
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+def diarization_agreement(reference: list, hypothesis: list) -> float:
+    """
+    计算两份说话人日志在时间上的一致程度。说话人编号可能不同，
+    因此每个 hypothesis 说话人映射到与其重叠时长最长的 reference 说话人。
+
+    :param reference: [[start, end, speaker_id], ...]
+    :param hypothesis: [[start, end, speaker_id], ...]
+    :return: 0~1，映射后说话人一致的时长占 reference 总时长的比例
+    """
+    total = sum(end - start for start, end, _ in reference)
+    if total <= 0:
+        return 1.0 if not hypothesis else 0.0
+
+    overlaps = {}
+    for h_start, h_end, h_speaker in hypothesis:
+        for r_start, r_end, r_speaker in reference:
+            duration = min(h_end, r_end) - max(h_start, r_start)
+            if duration > 0:
+                key = (h_speaker, r_speaker)
+                overlaps[key] = overlaps.get(key, 0.0) + duration
+
+    best = {}
+    for (h_speaker, _), duration in overlaps.items():
+        best[h_speaker] = max(best.get(h_speaker, 0.0), duration)
+    return sum(best.values()) / total
+
+def measure_throughput(fn, inputs: list, repeats: int = 3) -> float:
+    """
+    在单线程下测量每秒能处理的输入数，即单核吞吐量。测量结束后恢复原来的线程数。
+
+    :param fn: 处理单个输入的函数
+    :param inputs: 输入列表
+    :param repeats: 重复次数
+    :return: 单核每秒处理的输入数
+    """
+    if not inputs:
+        return 0.0
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        fn(inputs[0])  # 预热
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for item in inputs:
+                fn(item)
+        elapsed = time.perf_counter() - start
+    finally:
+        torch.set_num_threads(num_threads)
+    return repeats * len(inputs) / elapsed
+
+def accuracy_failures(result: dict) -> list:
+    """
+    按 ACCURACY_TOLERANCES 检查 check_accuracy 的结果。
+
+    :param result: check_accuracy 的结果
+    :return: 未达到容差的项目说明，全部达标时为空列表
+    """
+    failures = []
+    for name in ("punctuation", "segmentation", "diarization"):
+        for i, value in enumerate(result[name]):
+            if value < ACCURACY_TOLERANCES[name]:
+                failures.append(f"{name}[{i}]: agreement {value:.4f} < {ACCURACY_TOLERANCES[name]}")
+    for i, (eager_score, int8_score, eager_text, int8_text) in enumerate(result["verification"]):
+        if abs(eager_score - int8_score) > ACCURACY_TOLERANCES["verification"]:
+            failures.append(
+                f"verification[{i}]: score diff {abs(eager_score - int8_score):.4f} > {ACCURACY_TOLERANCES['verification']}"
+            )
+        if eager_text != int8_text:
+            failures.append(f"verification[{i}]: decision changed at thr={VERIFICATION_THRESHOLD} ({eager_text} -> {int8_text})")
+    return failures
+
+def check_accuracy(
+    texts: list = None,
+    wav_pairs: list = None,
+    diarization_wavs: list = None,
+    repeats: int = 3
+) -> dict:
+    """
+    对比 eager 与 int8 后端在说话人日志、说话人确认、标点、分段各阶段上的输出和吞吐量。
+
+    :param texts: 用于标点、分段对比的无标点文本，默认为 load_default_texts()
+    :param wav_pairs: 用于说话人确认对比的音频对 [(anchor_wav, test_wav), ...]，默认为 DEFAULT_WAV_PAIRS
+    :param diarization_wavs: 用于说话人日志对比的音频，默认为 DEFAULT_DIARIZATION_WAVS
+    :param repeats: 测量吞吐量时的重复次数
+    :return: {
+        "punctuation": [相似度, ...], "segmentation": [相似度, ...],
+        "verification": [[eager分数, int8分数, eager判定, int8判定], ...], "diarization": [一致程度, ...],
+        "throughput": {阶段: [eager 单核每秒处理数, int8 单核每秒处理数]},
+        "failures": [未达到容差的项目说明, ...]
+    }
+    """
+    texts = load_default_texts() if texts is None else texts
+    wav_pairs = DEFAULT_WAV_PAIRS if wav_pairs is None else wav_pairs
+    diarization_wavs = DEFAULT_DIARIZATION_WAVS if diarization_wavs is None else diarization_wavs
+
+    # 各模块的 pipeline 按当前 INFERENCE_BACKEND 创建，需以 eager 创建后再复制出 int8 版本进行对比
+    if os.getenv("INFERENCE_BACKEND", "eager").lower() != "eager":
+        raise RuntimeError("请在 INFERENCE_BACKEND=eager 下运行精度检查")
+
+    from add_punctuation import inference_pipline as punc_pipeline
+    from separate_document import p as seg_pipeline
+    from identify_speaker import sv_pipeline
+    from distinguish_speaker import sd_pipeline
+    from modelscope.outputs import OutputKeys
+
+    eager_pipelines = {
+        "punctuation": punc_pipeline,
+        "segmentation": seg_pipeline,
+        "verification": sv_pipeline,
+        "diarization": sd_pipeline,
+    }
+    int8_pipelines = {}
+    for name, eager_pipeline in eager_pipelines.items():
+        int8_pipelines[name] = quantize_pipeline(copy.deepcopy(eager_pipeline))
+        # 确认量化确实生效，避免与未量化的副本对比得到虚假的一致结果
+        if count_quantized_modules(int8_pipelines[name]) == 0:
+            raise RuntimeError(f"{name} 的 int8 副本中没有量化模块")
+        if count_quantized_modules(eager_pipeline) != 0:
+            raise RuntimeError(f"{name} 的 eager pipeline 中含有量化模块")
+
+    stages = {
+        "punctuation": (texts, lambda p, text: p(text)[0].get("text", "")),
+        # 分段阶段使用 eager 标点结果作为相同的输入，单独衡量量化带来的差异
+        "segmentation": (
+            [punc_pipeline(text)[0].get("text", "") for text in texts],
+            lambda p, text: p(documents=text)[OutputKeys.TEXT]
+        ),
+        "verification": (list(wav_pairs), lambda p, pair: p(list(pair), thr=VERIFICATION_THRESHOLD)),
+        "diarization": (list(diarization_wavs), lambda p, wav: p(wav).get("text", [])),
+    }
+    compare = {
+        "punctuation": text_similarity,
+        "segmentation": text_similarity,
+        "verification": lambda eager, int8: [
+            eager.get("score", 0.0), int8.get("score", 0.0), eager.get("text"), int8.get("text")
+        ],
+        "diarization": diarization_agreement,
+    }
+
+    result = {name: [] for name in stages}
+    result["throughput"] = {}
+    for name, (inputs, run) in stages.items():
+        if not inputs:
+            continue
+        eager_pipeline, int8_pipeline = eager_pipelines[name], int8_pipelines[name]
+        for item in inputs:
+            result[name].append(compare[name](run(eager_pipeline, item), run(int8_pipeline, item)))
+        result["throughput"][name] = [
+            measure_throughput(lambda item: run(eager_pipeline, item), inputs, repeats),
+            measure_throughput(lambda item: run(int8_pipeline, item), inputs, repeats),
+        ]
+
+    result["failures"] = accuracy_failures(result)
+    return result
+
+if __name__ == "__main__":
+    # 用法：INFERENCE_BACKEND=eager python inference_backend.py [anchor.wav test.wav [meeting.wav ...]]
+    # 不传音频时使用 DEFAULT_WAV_PAIRS 与 DEFAULT_DIARIZATION_WAVS；任一项未达到 ACCURACY_TOLERANCES 时以非零状态退出
+    wav_pairs = [tuple(sys.argv[1:3])] if len(sys.argv) >= 3 else None
+    diarization_wavs = sys.argv[3:] or None
+
+    result = check_accuracy(wav_pairs=wav_pairs, diarization_wavs=diarization_wavs)
+    for name in ("punctuation", "segmentation", "diarization"):
+        if result[name]:
+            print(f"{name}: min agreement {min(result[name]):.4f} (tolerance {ACCURACY_TOLERANCES[name]})")
+    for eager_score, int8_score, eager_text, int8_text in result["verification"]:
+        print(f"verification: eager {eager_score:.4f} ({eager_text}), int8 {int8_score:.4f} ({int8_text}), diff {abs(eager_score - int8_score):.4f}")
+    print("single-core throughput (torch.set_num_threads(1)):")
+    for name, (eager_rate, int8_rate) in result["throughput"].items():
+        print(f"  {name}: eager {eager_rate:.3f}/s, int8 {int8_rate:.3f}/s, speedup {int8_rate / eager_rate:.2f}x")
+
+    if result["failures"]:
+        print("Accuracy check FAILED:")
+        for failure in result["failures"]:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("Accuracy check passed.")
@@ -1,27 +1,178 @@
 import gradio as gr
 import os
+import re
+import shutil
 import dotenv
 from pydub import AudioSegment
 
 from distinguish_speaker import clip_audio, distinguish_speaker
 from add_punctuation import add_punctuation
 from separate_document import separate_document
-from transcribe_audio import transcribe_audio, format_transcription_to_text
+from transcribe_audio import iter_transcribe_audio, format_segment_to_text
 from analyze_transcript import analyze_transcript
 
 # 初始化处理模块
 
 
+def update_preview(speaker_previews: dict, speaker: str, text: str, k: int) -> None:
+    """
+    将新转写的文本追加到对应说话人的预览中，每个说话人最多保留 k 个字符，
+    超出部分直接丢弃，保证预览占用的内存与会议时长无关。
+
+    :param speaker_previews: {speaker: [已保留的预览文本, 是否被截断]}
+    :param speaker: 说话人
+    :param text: 新转写的文本
+    :param k: 每个说话人预览的字符数
+    """
+    if speaker not in speaker_previews:
+        speaker_previews[speaker] = ["", False]
+    preview = speaker_previews[speaker]
+    remaining = k - len(preview[0])
+    if remaining > 0:
+        preview[0] += text[:remaining]
+    if len(text) > max(remaining, 0):
+        preview[1] = True
+
+def format_preview(speaker_previews: dict) -> str:
+    """
+    将各说话人的预览格式化为文本。
+
+    :param speaker_previews: {speaker: [已保留的预览文本, 是否被截断]}
+    :return: 预览文本
+    """
+    preview_lines = []
+    # 按 speaker 名称排序，确保预览输出顺序一致
+    for speaker in sorted(speaker_previews.keys()):
+        text, truncated = speaker_previews[speaker]
+        preview_lines.append(f"{speaker}：")
+        preview_lines.append(text + ("..." if truncated else ""))
+        preview_lines.append("")
+    
+    return "\n".join(preview_lines)
+
+def read_transcript_page(transcript_path: str, page_offsets: list, page: int) -> str:
+    """
+    从转译原文文件中读取指定页，只加载该页对应的字节范围。
+
+    :param transcript_path: 转译原文文件路径
+    :param page_offsets: 每一页在文件中的起始字节位置
+    :param page: 页码，从 1 开始
+    :return: 该页的文本
+    """
+    if not transcript_path or not page_offsets:
+        return ""
+    page = min(max(int(page or 1), 1), len(page_offsets))
+    with open(transcript_path, "rb") as f:
+        f.seek(page_offsets[page - 1])
+        if page < len(page_offsets):
+            data = f.read(page_offsets[page] - page_offsets[page - 1])
+        else:
+            data = f.read()
+    return data.decode("utf-8").strip("\n")
+
+def write_transcript_page(transcript_path: str, page_offsets: list, page: int, text: str) -> list:
+    """
+    将修改后的一页文本写回转译原文文件，其余页按字节原样复制，并更新之后各页的起始位置。
+
+    :param transcript_path: 转译原文文件路径
+    :param page_offsets: 每一页在文件中的起始字节位置
+    :param page: 页码，从 1 开始
+    :param text: 修改后的该页文本
+    :return: 更新后的 page_offsets
+    """
+    page = min(max(int(page or 1), 1), len(page_offsets))
+    start = page_offsets[page - 1]
+    end = page_offsets[page] if page < len(page_offsets) else os.path.getsize(transcript_path)
+    data = (text.strip("\n") + "\n").encode("utf-8")
+
+    temp_path = f"{transcript_path}.tmp"
+    with open(transcript_path, "rb") as src, open(temp_path, "wb") as dst:
+        remaining = start
+        while remaining > 0:
+            chunk = src.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+        dst.write(data)
+        src.seek(end)
+        shutil.copyfileobj(src, dst)
+    os.replace(temp_path, transcript_path)
+
+    delta = len(data) - (end - start)
+    return page_offsets[:page] + [offset + delta for offset in page_offsets[page:]]
+
+def save_transcript_page(transcript_file, transcript_path, page_offsets, page, text):
+    """
+    保存对当前页转译原文的修改，生成报告时使用修改后的文件。
+
+    :param transcript_file: 转译原文下载文件，转译完成前为空
+    :param transcript_path: 分页浏览的转译原文文件路径
+    :param page_offsets: 每一页在文件中的起始字节位置
+    :param page: 当前页码
+    :param text: 修改后的当前页文本
+    :return: 更新后的 page_offsets
+    """
+    if not transcript_file or not transcript_path or not page_offsets:
+        raise gr.Error("请等待转译完成后再保存修改")
+    page_offsets = write_transcript_page(transcript_path, page_offsets, page, text)
+    gr.Info(f"第 {int(page or 1)} 页的修改已保存")
+    return page_offsets
+
+# 转译原文中每个片段的标题行，如 "00:00:00-00:00:09，speaker0："
+SEGMENT_HEADER_PATTERN = re.compile(r"^\d{2}:\d{2}:\d{2}-\d{2}:\d{2}:\d{2}，.*：$")
+
+def index_transcript(transcript_file):
+    """
+    为上传的（可能经过修改的）转译原文重新建立分页索引，并返回第一页。
+    按片段标题行分页；若文件中没有标题行，则按行分页。
+
+    :param transcript_file: 上传的转译原文文件
+    :return: transcript_page, transcript_path, page_offsets, page_number
+    """
+    if not transcript_file:
+        return "", None, [], gr.update(value=1, label="页码")
+
+    # 兼容 gradio 3 (临时文件对象) 与 gradio 4 (文件路径)
+    transcript_path = getattr(transcript_file, "name", transcript_file)
+    page_size = int(os.getenv("TRANSCRIPTION_PAGE_SEGMENTS", "50"))
+
+    # 只记录每页的起始位置，内存占用与文件大小无关
+    header_pages, header_count = [0], 0
+    line_pages, line_count = [], 0
+    with open(transcript_path, "rb") as f:
+        offset = 0
+        for line in iter(f.readline, b""):
+            if SEGMENT_HEADER_PATTERN.match(line.decode("utf-8", errors="ignore").strip()):
+                # 第一个标题行之前的内容并入第一页
+                if header_count and header_count % page_size == 0:
+                    header_pages.append(offset)
+                header_count += 1
+            if line_count % page_size == 0:
+                line_pages.append(offset)
+            line_count += 1
+            offset += len(line)
+
+    page_offsets = header_pages if header_count else (line_pages or [0])
+
+    return (
+        read_transcript_page(transcript_path, page_offsets, 1),
+        transcript_path,
+        page_offsets,
+        gr.update(value=1, label=f"页码（共 {len(page_offsets)} 页）"),
+    )
+
 def process_audio(raw_audio_path):
     """
     处理传入的音频：
         1. 统一转换为 .wav 格式
         2. 调用 distinguish_speaker.py 生成说话人日志
-        3. 调用 transcribe_audio.py 生成转译结果
-        4. 对转译结果进行处理，生成预览、转译原文、.wav 音频路径
+        3. 调用 transcribe_audio.py 逐段生成转译结果，并流式更新预览与当前页的转译原文
+        4. 转译原文逐段写入文件，供分页浏览与下载
 
     :param raw_audio_path: 传入的音频路径
-    :return: preview, transcription, processed_audio_path
+    :return: 生成器，逐步产出 preview, transcript_page, processed_audio_path,
+             transcript_file, transcript_path, page_offsets, page_number
     """
     if not raw_audio_path:
         raise gr.Error("请先上传音频文件")
@@ -40,41 +191,64 @@ def process_audio(raw_audio_path):
             processed_audio_path = wav_path
         except Exception as e:
             raise gr.Error(f"音频文件转换失败: {e}")
-            
+
+    # 转译完成前页码不可修改，始终显示正在写入的页
+    yield "正在生成说话人日志...", "", processed_audio_path, None, None, [], gr.update(interactive=False)
+
     # 1. 生成说话人日志
     raw_diarization = distinguish_speaker(processed_audio_path)
     
-    # 2. 生成转译结果
-    transcription_result = transcribe_audio(processed_audio_path, raw_diarization)
-
-    # 3. 生成预览和转译原文
+    # 2. 逐段生成转译结果，同步更新预览和转译原文
     k = int(os.getenv("TRANSCRIPTION_PREVIEW_WORDS", "100"))  # 预览的字符数，默认100
-    speaker_texts = {}
-    for _, _, speaker, text in transcription_result.get("result", []):
-        if speaker not in speaker_texts:
-            speaker_texts[speaker] = ""
-        speaker_texts[speaker] += text
-    
-    preview_lines = []
-    # 按 speaker 名称排序，确保预览输出顺序一致
-    for speaker in sorted(speaker_texts.keys()):
-        preview_lines.append(f"{speaker}：")
-        preview_lines.append(speaker_texts[speaker][:k] + ("..." if len(speaker_texts[speaker]) > k else ""))
-        preview_lines.append("")
-    
-    preview = "\n".join(preview_lines)
+    page_size = int(os.getenv("TRANSCRIPTION_PAGE_SEGMENTS", "50"))  # 每页的片段数，默认50
+    transcript_path = f"{file_name}_transcript.txt"
+
+    speaker_previews = {}
+    page_offsets = []
+    page_segments = []  # 仅保留当前页的片段文本
+    with open(transcript_path, "wb") as f:
+        for segment in iter_transcribe_audio(processed_audio_path, raw_diarization):
+            _, _, speaker, text = segment
+            update_preview(speaker_previews, speaker, text, k)
 
-    transcript_text = format_transcription_to_text(transcription_result)
+            if len(page_segments) == page_size:
+                page_segments = []
+            if not page_segments:
+                page_offsets.append(f.tell())
 
-    return preview, transcript_text, processed_audio_path
+            segment_text = format_segment_to_text(segment)
+            f.write((segment_text + "\n").encode("utf-8"))
+            f.flush()
+            page_segments.append(segment_text)
+
+            yield (
+                format_preview(speaker_previews),
+                "\n".join(page_segments),
+                processed_audio_path,
+                None,
+                transcript_path,
+                list(page_offsets),
+                gr.update(value=len(page_offsets), interactive=False, label=f"页码（转译中，共 {len(page_offsets)} 页）"),
+            )
+
+    # 3. 转译完成后提供原文下载，并回到第一页
+    yield (
+        format_preview(speaker_previews),
+        read_transcript_page(transcript_path, page_offsets, 1),
+        processed_audio_path,
+        transcript_path,
+        transcript_path,
+        page_offsets,
+        gr.update(value=1, interactive=True, label=f"页码（共 {len(page_offsets)} 页）"),
+    )
 
-def generate_report(meeting_time, meeting_place, transcript, speakers):
+def generate_report(meeting_time, meeting_place, transcript_file, speakers):
     """
     根据补充信息+会议转译生成通用、大纲形式的报告。
 
     :param meeting_time: 会议时间
     :param meeting_place: 会议地点
-    :param transcript: 会议转译内容
+    :param transcript_file: 会议转译原文文件（可下载修改后重新上传）
     :param speakers: 说话人顺序信息
     :return general_result, concise_result, "general_report.md", "concise_report.md" （.md报告下载路径）
     """
@@ -82,6 +256,13 @@ def generate_report(meeting_time, meeting_place, transcript, speakers):
         raise gr.Error("请输入说话人信息")
     if not meeting_time:
         raise gr.Error("请输入会议时间")
+    if not transcript_file:
+        raise gr.Error("请先完成音频处理或上传转译原文")
+
+    # 兼容 gradio 3 (临时文件对象) 与 gradio 4 (文件路径)
+    transcript_path = getattr(transcript_file, "name", transcript_file)
+    with open(transcript_path, "r", encoding="utf-8") as f:
+        transcript = f.read()
     
     # 保存转录文件
     with open("meeting_transcript.txt", "w", encoding="utf-8") as f:
@@ -119,8 +300,9 @@ with gr.Blocks(title="会议纪要生成系统") as demo:
     gr.Markdown("## 🎙️ 会议智能分析系统")
     
     # 状态变量
-    transcript_state = gr.State()
     audio_state = gr.State()
+    transcript_path_state = gr.State()
+    page_offsets_state = gr.State([])
     
     with gr.Tab("会议处理"):
         with gr.Row(equal_height=True):
@@ -147,11 +329,16 @@ with gr.Blocks(title="会议纪要生成系统") as demo:
 
             with gr.Column(scale=3):
                 transcript_output = gr.Textbox(
-                    label="转译原文", 
-                    lines=28, 
+                    label="转译原文（可直接修改当前页，点击“保存本页修改”后生效）", 
+                    lines=24, 
+                    max_lines=24,
                     min_width=600,
                     interactive=True
                 )
+                with gr.Row():
+                    page_input = gr.Number(value=1, precision=0, label="页码")
+                    save_page_btn = gr.Button(value="保存本页修改")
+                    transcript_download = gr.File(label="转译原文（可下载修改后重新上传）")
             
         with gr.Row(equal_height=True):
 
@@ -178,14 +365,34 @@ with gr.Blocks(title="会议纪要生成系统") as demo:
     transcribe_audio_btn.click(
         process_audio,
         inputs=audio_input,
-        outputs=[preview_output, transcript_output, audio_state]
+        outputs=[preview_output, transcript_output, audio_state, transcript_download, transcript_path_state, page_offsets_state, page_input]
+    )
+
+    # 重新上传修改后的转译原文时，分页浏览同步切换到上传的文件
+    transcript_download.upload(
+        index_transcript,
+        inputs=transcript_download,
+        outputs=[transcript_output, transcript_path_state, page_offsets_state, page_input]
+    )
+
+    save_page_btn.click(
+        save_transcript_page,
+        inputs=[transcript_download, transcript_path_state, page_offsets_state, page_input, transcript_output],
+        outputs=page_offsets_state
+    )
+
+    page_input.change(
+        read_transcript_page,
+        inputs=[transcript_path_state, page_offsets_state, page_input],
+        outputs=transcript_output
     )
     
     generate_report_btn.click(
         generate_report,
-        inputs=[meeting_time, meeting_place, transcript_output, speaker_input],
+        inputs=[meeting_time, meeting_place, transcript_download, speaker_input],
         outputs=[general_report_output, concise_report_output, general_download, concise_download]
     )
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
+    # 启用队列以支持 process_audio 的流式输出
+    demo.queue().launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file
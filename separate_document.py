@@ -1,9 +1,9 @@
 import re
 from modelscope.outputs import OutputKeys
-from modelscope.pipelines import pipeline
 from modelscope.utils.constant import Tasks
+from inference_backend import build_pipeline
 
-p = pipeline(
+p = build_pipeline(
     task=Tasks.document_segmentation,
     model='iic/nlp_bert_document-segmentation_chinese-base', model_revision='master')
 
@@ -0,0 +1,84 @@
+import sys
+import types
+
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+# distinguish_speaker 在导入时会加载说话人日志与说话人确认模型，这里替换为不加载模型的桩
+sys.modules["inference_backend"] = types.SimpleNamespace(build_pipeline=lambda **kwargs: None)
+sys.modules["identify_speaker"] = types.SimpleNamespace(is_same_speaker=None, sv_pipeline=None)
+
+import distinguish_speaker
+
+
+@pytest.fixture
+def verification_calls(monkeypatch, tmp_path):
+    """
+    将剪辑与声纹比对替换为桩，记录声纹比对的调用；所有声纹比对都判定为不同说话人。
+    """
+    calls = []
+
+    def fake_clip_audio(input_wav, start_time, end_time, output_wav):
+        open(output_wav, "w").close()
+        return True
+
+    def fake_is_same_speaker(anchor_wav, test_wav):
+        calls.append((anchor_wav, test_wav))
+        return False
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(distinguish_speaker, "clip_audio", fake_clip_audio)
+    monkeypatch.setattr(distinguish_speaker, "is_same_speaker", fake_is_same_speaker)
+    return calls
+
+
+def test_speaker_matched_by_time_in_overlap(verification_calls):
+    final = {"speaker0": [[0, 100]], "speaker1": [[100, 120]]}
+    # 当前块从 115 s 开始，前 5 s 与上一块重叠；speaker0 在重叠区域内与 speaker1 吻合
+    test = {"speaker0": [[0, 4], [10, 30]]}
+
+    merged = distinguish_speaker.merge_same_speaker("raw.wav", final, "chunk.wav", test, 115, 5)
+
+    assert merged == {"speaker0": [[0, 100]], "speaker1": [[100, 120], [125, 145]]}
+    assert verification_calls == []
+
+
+def test_speaker_only_inside_overlap_is_dropped(verification_calls):
+    final = {"speaker0": [[0, 100]], "speaker1": [[100, 115]]}
+    # speaker0 只在重叠区域内说话且时间上不吻合，speaker1 是真正的新说话人
+    test = {"speaker0": [[1, 4]], "speaker1": [[10, 40]]}
+
+    merged = distinguish_speaker.merge_same_speaker("raw.wav", final, "chunk.wav", test, 115, 5)
+
+    assert merged == {"speaker0": [[0, 100]], "speaker1": [[100, 115]], "speaker2": [[125, 155]]}
+    assert all("test_speaker0" not in test_wav for _, test_wav in verification_calls)
+
+
+def test_segment_crossing_overlap_boundary_is_trimmed(verification_calls):
+    final = {"speaker0": [[0, 120]]}
+    test = {"speaker0": [[2, 20]]}
+
+    merged = distinguish_speaker.merge_same_speaker("raw.wav", final, "chunk.wav", test, 115, 5)
+
+    # 重叠区域 [115, 120] 已由上一块给出，只追加 120 s 之后的部分
+    assert merged == {"speaker0": [[0, 120], [120, 135]]}
+    assert verification_calls == []
+
+
+def tone(duration_ms: int) -> AudioSegment:
+    return Sine(440, sample_rate=16000).to_audio_segment(duration=duration_ms)
+
+
+def test_no_cut_when_remaining_audio_is_under_one_and_a_half_chunks():
+    assert distinguish_speaker.find_cut_points(tone(85000), 60000, 10000) == []
+
+
+def test_cut_placed_at_silence_near_target():
+    # 55 s 处有 1 s 静音；切分后剩余不足 1.5 个分块，不再继续切分
+    sound = tone(55000) + AudioSegment.silent(duration=1000, frame_rate=16000) + tone(74000)
+
+    cut_points = distinguish_speaker.find_cut_points(sound, 60000, 10000)
+
+    assert len(cut_points) == 1
+    assert 55000 <= cut_points[0] <= 56000
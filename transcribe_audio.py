@@ -70,58 +70,89 @@ def sort_diarization(raw_diarization: dict) -> dict:
 
     return {"sorted_diarization": merged_segments}
 
-def transcribe_audio(audio_wav: str, raw_diarization: dict) -> dict:
+def iter_transcribe_audio(audio_wav: str, raw_diarization: dict):
     """
-    对传入的每个音频段进行转写。
+    逐段转写音频，每完成一段即产出一段结果，便于调用方流式展示。
 
     :param audio_wav: 原始音频文件路径
     :param raw_diarization: 未处理的说话人日志 e.g., {'speaker0': [[start, end], ...]}
-    :return: {"result": [[开始时间, 结束时间, 说话人ID, 转写内容], ...]}
+    :return: 生成器，逐个产出 [开始时间, 结束时间, 说话人ID, 转写内容]
     """
     sorted_diarization = sort_diarization(raw_diarization)
 
     all_segments = sorted_diarization.get("sorted_diarization", [])
     
-    results = []
     temp_dir = "temp_transcribe_clips"
     os.makedirs(temp_dir, exist_ok=True)
 
     print(f"Start transcribing {len(all_segments)} audio segments...")
-    for i, segment in enumerate(all_segments):
-        start, end, speaker_id_int = segment
-        speaker = f"speaker{speaker_id_int}"
-        
-        clip_path = os.path.join(temp_dir, f"segment_{i}.wav")
-        if not clip_audio(audio_wav, start, end, clip_path):
-            continue
+    try:
+        for i, segment in enumerate(all_segments):
+            start, end, speaker_id_int = segment
+            speaker = f"speaker{speaker_id_int}"
+            
+            clip_path = os.path.join(temp_dir, f"segment_{i}.wav")
+            if not clip_audio(audio_wav, start, end, clip_path):
+                continue
+
+            try:
+                with open(clip_path, "rb") as audio_file:
+                    raw_text = model.transcriptions(audio_file.read()).get("text","")
+
+                # transcription_result = model.transcribe(
+                #     clip_path,
+                #     language="zh",
+                #     task="transcribe",
+                #     prompt="以下是普通话的句子。这是一段会议记录的语音片段。"
+                # )
+                # text = transcription_result.get('text', '').strip()
+
+                unsplit_text = add_punctuation(raw_text)
+                text = separate_document(unsplit_text)
+
+                print(f"  Segment {i+1}/{len(all_segments)}: [{start:.2f}s - {end:.2f}s] Speaker: {speaker} -> {text}")
+            except Exception as e:
+                text = f"[ERROR: {e}]"
+                print(f"  Error transcribing segment {i+1}: {e}")
+
+            os.remove(clip_path)
+
+            yield [start, end, speaker, text]
+    finally:
+        # 调用方提前停止迭代时同样清理临时目录
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-        try:
-            with open(clip_path, "rb") as audio_file:
-                raw_text = model.transcriptions(audio_file.read()).get("text","")
-
-            # transcription_result = model.transcribe(
-            #     clip_path,
-            #     language="zh",
-            #     task="transcribe",
-            #     prompt="以下是普通话的句子。这是一段会议记录的语音片段。"
-            # )
-            # text = transcription_result.get('text', '').strip()
-
-            unsplit_text = add_punctuation(raw_text)
-            text = separate_document(unsplit_text)
-
-            print(f"  Segment {i+1}/{len(all_segments)}: [{start:.2f}s - {end:.2f}s] Speaker: {speaker} -> {text}")
-        except Exception as e:
-            text = f"[ERROR: {e}]"
-            print(f"  Error transcribing segment {i+1}: {e}")
-        
-        results.append([start, end, speaker, text])
+def transcribe_audio(audio_wav: str, raw_diarization: dict) -> dict:
+    """
+    对传入的每个音频段进行转写。
+
+    :param audio_wav: 原始音频文件路径
+    :param raw_diarization: 未处理的说话人日志 e.g., {'speaker0': [[start, end], ...]}
+    :return: {"result": [[开始时间, 结束时间, 说话人ID, 转写内容], ...]}
+    """
+    return {"result": list(iter_transcribe_audio(audio_wav, raw_diarization))}
+
+def format_timestamp(seconds: float) -> str:
+    """
+    将秒数格式化为 HH:MM:SS 形式的时间戳。
 
-        os.remove(clip_path)
+    :param seconds: 时间 (秒)
+    :return: "HH:MM:SS"
+    """
+    h, m, s = int(seconds // 3600), int((seconds % 3600) // 60), int(seconds % 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
 
-    shutil.rmtree(temp_dir)
+def format_segment_to_text(segment: list) -> str:
+    """
+    将单个转写片段格式化为文本：
+    开始时间-结束时间，说话人：
+    文本内容
 
-    return {"result": results}
+    :param segment: [start, end, speaker, text]
+    :return: 格式化后的两行字符串（文本内容本身可能包含换行）
+    """
+    start_time, end_time, speaker, text = segment
+    return f"{format_timestamp(start_time)}-{format_timestamp(end_time)}，{speaker}：\n{text}"
 
 def format_transcription_to_text(transcription_result: dict) -> str:
     """
@@ -133,23 +164,9 @@ def format_transcription_to_text(transcription_result: dict) -> str:
     :param transcription_result: 包含 'result' 键的字典，其值为 [start, end, speaker, text] 的列表。
     :return: 格式化后的多行字符串。
     """
-    lines = []
-    for segment in transcription_result.get("result", []):
-        start_time, end_time, speaker, text = segment
-        
-        # 格式化开始时间
-        start_h, start_m, start_s = int(start_time // 3600), int((start_time % 3600) // 60), int(start_time % 60)
-        start_timestamp = f"{start_h:02d}:{start_m:02d}:{start_s:02d}"
-        
-        # 格式化结束时间
-        end_h, end_m, end_s = int(end_time // 3600), int((end_time % 3600) // 60), int(end_time % 60)
-        end_timestamp = f"{end_h:02d}:{end_m:02d}:{end_s:02d}"
-        
-        lines.append(f"{start_timestamp}-{end_timestamp}，{speaker}：")
-        lines.append(text)
-        # lines.append("") # 为下一段添加空行，提高可读性
-    
-    return "\n".join(lines)
+    return "\n".join(
+        format_segment_to_text(segment) for segment in transcription_result.get("result", [])
+    )
 
 if __name__ == "__main__":
     # x = {